@@ -69,9 +69,12 @@ print("ABI saved to punk_predictor_abi.json")
 
 # Prepare account and transaction parameters
 account = w3.eth.account.from_key(PRIVATE_KEY)
-deploy_nonce = w3.eth.get_transaction_count(account.address)
+# Fetch the nonce and latest block in a single HTTP round trip
+with w3.batch_requests() as batch:
+    batch.add(w3.eth.get_transaction_count(account.address))
+    batch.add(w3.eth.get_block("latest"))
+    deploy_nonce, latest_block = batch.execute()
 # Determine if network uses EIP-1559 (baseFee present) for fee fields
-latest_block = w3.eth.get_block("latest")
 base_fee = latest_block.get("baseFeePerGas")
 if base_fee is not None:
     # EIP-1559 fee structure
@@ -1,127 +1,179 @@
+import functools
+import hashlib
 import json
+import logging
+import operator
 import os
 import time
 import sqlite3
+import requests
 from web3 import Web3
 from dotenv import load_dotenv
 import numpy as np
 import pandas as pd
-import math
-import secrets
-import struct
 import uuid
 import sqlite3
 from typing import Dict, List, Tuple
-from Crypto.Hash import keccak
+
+logger = logging.getLogger(__name__)
+
+# Prefer the fastest available Keccak-256 backend: pysha3, then OpenSSL (>= 3.2)
+# through hashlib, and finally pycryptodome, which is roughly 10x slower.
+try:
+    from sha3 import keccak_256
+except ImportError:
+    try:
+        # Probe directly: KECCAK-256 has no OpenSSL NID, so it never shows up
+        # in hashlib.algorithms_available even where hashlib.new() accepts it
+        hashlib.new('KECCAK-256')
+
+        def keccak_256(data: bytes = b''):
+            return hashlib.new('KECCAK-256', data)
+    except ValueError:
+        from Crypto.Hash import keccak
+
+        def keccak_256(data: bytes = b''):
+            return keccak.new(digest_bits=256, data=data)
 
 def keccak256(x: bytes) -> bytes:
-    h = keccak.new(digest_bits=256)
-    h.update(x)
-    return h.digest()
+    return keccak_256(x).digest()
 
 def pair_hash(a: bytes, b: bytes) -> bytes:
     return keccak256(a + b)
 
+DEFAULT_HASH = keccak256(b'\x00')  # Fills the padded leaf slots
+
 def ceil_log2(n: int) -> int:
-    return math.ceil(math.log2(n)) if n > 0 else 0
+    # Exact integer version; math.log2 rounds for large n (e.g. 2**53 + 1)
+    return (n - 1).bit_length() if n > 1 else 0
+
+def _hash_leaves(view: memoryview) -> bytes:
+    """Hashes consecutive 40-byte leaf preimages of `view` into concatenated 32-byte digests."""
+    return b''.join(keccak256(view[off:off + 40]) for off in range(0, len(view), 40))
 
 def create_merkle_leaves(df: pd.DataFrame) -> Tuple[Dict[int, bytes], Dict[int, bytes], Dict[int, float]]:
     """
     Creates Merkle leaves from a DataFrame with predictions.
     Returns dictionaries for leaf hashes, salts, and original predictions.
     """
-    leaves_db: Dict[int, bytes] = {}
-    salts_db: Dict[int, bytes] = {}
-    predictions_db: Dict[int, float] = {}
-    
-    for idx, row in df.iterrows():
-        # Get the prediction value
-        pred_value = row['pred']
-        # Generate a secure random salt (32 bytes)
-        salt = secrets.token_bytes(32)
-        # Pack the float into bytes using struct
-        float_bytes = struct.pack('!d', pred_value)
-        # Combine float and salt
-        leaf_data = float_bytes + salt
-        # Hash the combined data
-        leaf_hash = keccak256(leaf_data)
-        
-        # Store all components
-        leaves_db[idx] = leaf_hash
-        salts_db[idx] = salt
-        predictions_db[idx] = pred_value
+    n_leaves = len(df)
+    # Big-endian float64 matches struct.pack('!d', pred_value) byte for byte
+    preds = df['pred'].to_numpy(dtype='>f8')
+    # One CSPRNG read for every salt instead of a token_bytes(32) call per leaf
+    salt_blob = os.urandom(32 * n_leaves)
+
+    # Lay every leaf preimage (8-byte float || 32-byte salt) out in one
+    # contiguous buffer so hashing walks fixed 40-byte strides with no
+    # per-row packing or concatenation. Both columns are written straight
+    # from zero-copy views, so no per-leaf bytes objects exist before hashing.
+    buf = np.empty((n_leaves, 40), dtype=np.uint8)
+    buf[:, :8] = preds.view(np.uint8).reshape(n_leaves, 8)
+    buf[:, 8:] = np.frombuffer(salt_blob, dtype=np.uint8).reshape(n_leaves, 32)
+
+    hashes = _hash_leaves(memoryview(buf.reshape(-1)))
+
+    leaves_db: Dict[int, bytes] = {idx: hashes[off:off + 32]
+                                   for idx, off in enumerate(range(0, 32 * n_leaves, 32))}
+    salts_db: Dict[int, bytes] = {idx: salt_blob[off:off + 32]
+                                  for idx, off in enumerate(range(0, 32 * n_leaves, 32))}
+    predictions_db: Dict[int, float] = dict(enumerate(preds.tolist()))
     
     return leaves_db, salts_db, predictions_db
-def compute_merkle_proof(index: int, leaves_db: Dict[int, bytes], default_hash: bytes) -> Tuple[List[bytes], bytes]:
+def _hash_pairs(view: memoryview) -> bytes:
+    """Hashes consecutive 64-byte pairs of `view` into concatenated 32-byte digests."""
+    return b''.join(keccak256(view[off:off + 64]) for off in range(0, len(view), 64))
+
+def _hash_layer(children: np.ndarray) -> np.ndarray:
     """
-    Builds the proof path for `index` and returns (proof, root).
-    Matches the contract's verification logic exactly.
+    Hashes each (left, right) pair of a (2m, 32) uint8 layer into a (m, 32) parent layer.
+    Pairs are sorted before hashing, matching the contract's verification logic.
+    """
+    left, right = children[0::2], children[1::2]
+    # Lexicographic compare of 32-byte rows: decide on the first differing byte
+    first_diff = (left != right).argmax(axis=1)
+    rows = np.arange(len(left))
+    swap = left[rows, first_diff] > right[rows, first_diff]
+    pairs = np.where(swap[:, None], np.hstack((right, left)), np.hstack((left, right)))
+
+    parents = _hash_pairs(memoryview(pairs.reshape(-1)))
+    return np.frombuffer(parents, dtype=np.uint8).reshape(len(pairs), 32)
+
+def _empty_tree(leaves: bytes, size: int, default_hash: bytes) -> np.ndarray:
+    """
+    Allocates the contiguous (2*size, 32) byte tree with the leaves filled in.
+    Leaves are in tree[0...size-1], internal nodes in tree[size...2*size-2],
+    each layer stored right after its children; the root is tree[2*size-2].
+    """
+    n_leaves = len(leaves) // 32
+    tree = np.empty((2 * size, 32), dtype=np.uint8)
+    tree[:] = np.frombuffer(default_hash, dtype=np.uint8)  # Unused leaf slots remain default_hash
+    if n_leaves:
+        tree[:n_leaves] = np.frombuffer(leaves, dtype=np.uint8).reshape(n_leaves, 32)
+    return tree
+
+def build_tree(leaves_db: Dict[int, bytes], default_hash: bytes = DEFAULT_HASH) -> Tuple[np.ndarray, bytes]:
+    """
+    Builds the full padded tree and returns (tree, root).
+    The internal nodes, tree[size:], are what gets persisted alongside the root.
     """
-    proof: List[bytes] = []
     n_leaves = len(leaves_db)
     depth = ceil_log2(max(n_leaves, 1))
     size = 1 << depth  # Padded leaf layer size
+    tree = _empty_tree(b''.join(leaves_db[i] for i in range(n_leaves)), size, default_hash)
+
+    # defaults[d] is the root of an all-padding subtree of height d
+    defaults = [default_hash]
+    for _ in range(depth):
+        defaults.append(keccak256(defaults[-1] + defaults[-1]))
+
+    layer_start_idx = 0
+    n_real = n_leaves  # Nodes in the current layer with at least one real leaf below
+    for d in range(depth):
+        layer_size = size >> d
+        parent_start_idx = layer_start_idx + layer_size
+        # Only pairs touching a real node need hashing; the rest are known defaults
+        n_pairs = (n_real + 1) // 2
+        if n_pairs:
+            tree[parent_start_idx:parent_start_idx + n_pairs] = \
+                _hash_layer(tree[layer_start_idx:layer_start_idx + 2 * n_pairs])
+        tree[parent_start_idx + n_pairs:parent_start_idx + layer_size // 2] = \
+            np.frombuffer(defaults[d + 1], dtype=np.uint8)
+        layer_start_idx = parent_start_idx
+        n_real = n_pairs
 
-    # Initialize the tree array.
-    # Leaves will be in tree[0...size-1].
-    # Internal nodes will be in tree[size...2*size-1].
-    tree = [default_hash] * (2 * size)
-    for idx, hash_val in leaves_db.items(): # leaves_db keys are original 0 to n_leaves-1
-        tree[idx] = hash_val # Populate actual leaves. Unused leaf slots remain default_hash.
-
-    # Tree building part (this part from your file is correct)
-    # layer_start_idx tracks the global start index of the current layer of children.
-    # parent_layer_start_idx tracks the global start index where parents are being written.
-    layer_start_idx = 0 
-    parent_layer_start_idx = size 
-    for d_loop_var in range(depth): # d_loop_var from 0 (processing leaves) to depth-1
-        num_nodes_in_current_layer = size >> d_loop_var # Number of nodes in the child layer
-        for i_child_pair in range(0, num_nodes_in_current_layer, 2): # Iterate over pairs of children
-            left_child = tree[layer_start_idx + i_child_pair]
-            right_child = tree[layer_start_idx + i_child_pair + 1]
-            
-            parent_node_idx_in_parent_layer = i_child_pair // 2 # Parent's relative index in its layer
-            current_parent_global_idx = parent_layer_start_idx + parent_node_idx_in_parent_layer
-            
-            if left_child <= right_child:
-                tree[current_parent_global_idx] = keccak256(left_child + right_child)
-            else:
-                tree[current_parent_global_idx] = keccak256(right_child + left_child)
-        
-        layer_start_idx = parent_layer_start_idx # Parents of this level become children for the next
-        parent_layer_start_idx += (num_nodes_in_current_layer // 2) # Advance parent write position
-    
     # After the loop, layer_start_idx is the global index of the root node.
-    root = tree[layer_start_idx]
+    return tree, tree[layer_start_idx].tobytes()
 
-    # Corrected Proof Collection:
-    current_node_relative_idx = index # Leaf's index relative to its layer (0 to layer_size-1)
+def extract_proof(tree: np.ndarray, size: int, index: int) -> List[bytes]:
+    """Walks up from leaf `index` collecting the sibling at each layer; O(log N), no hashing."""
+    proof: List[bytes] = []
+    layer_start_idx = 0
+    layer_size = size
+    while layer_size > 1:
+        proof.append(tree[layer_start_idx + (index ^ 1)].tobytes())
+        layer_start_idx += layer_size
+        layer_size //= 2
+        index //= 2
+    return proof
 
-    for d_current_layer_level in range(depth): # Iterate from layer 0 (leaves) up to layer depth-1
-        
-        # Determine the global starting index of the current layer (d_current_layer_level) in the `tree` array.
-        # Layer 0 (leaves) starts at global index 0.
-        # Layer d (d > 0) starts at global index: 2*size - (size / 2^(d-1))
-        current_layer_global_start_idx: int
-        if d_current_layer_level == 0:
-            current_layer_global_start_idx = 0
-        else:
-            current_layer_global_start_idx = (size << 1) - (size >> (d_current_layer_level - 1))
-
-        sibling_node_relative_idx = current_node_relative_idx ^ 1 # Sibling's index within the current layer
-        sibling_node_global_idx_in_tree = current_layer_global_start_idx + sibling_node_relative_idx
-        
-        proof.append(tree[sibling_node_global_idx_in_tree])
-        
-        # Move to the parent's relative index for the next iteration
-        current_node_relative_idx = current_node_relative_idx // 2
-        
-    return proof, root
+def compute_merkle_proof(index: int, leaves_db: Dict[int, bytes], default_hash: bytes) -> Tuple[List[bytes], bytes]:
+    """
+    Builds the proof path for `index` and returns (proof, root).
+    Matches the contract's verification logic exactly.
+    """
+    tree, root = build_tree(leaves_db, default_hash)
+    return extract_proof(tree, len(tree) // 2, index), root
 
-def get_merkle_proof_for_leaf(tree_id: str, leaf_index: int, db_path='merkle_tree.db') -> Tuple[bytes, List[bytes]]:
+@functools.lru_cache(maxsize=8)
+def _load_tree(tree_id: str, db_path: str) -> Tuple[bytes, np.ndarray, int]:
     """
-    Retrieve a leaf and compute its proof on-demand from the local SQLite database.
+    Loads a tree from SQLite once; repeated proof requests for the same tree
+    reuse the cached (root, tree, size). Older trees keep their leaves as
+    merkle_leaves rows, and those stored without internal nodes are rebuilt.
     """
+    # Bring databases written by older versions up to the current schema before reading
+    init_db(db_path)
+    
     conn = sqlite3.connect(db_path)
     conn.row_factory = sqlite3.Row
     cur = conn.cursor()
@@ -129,7 +181,7 @@ def get_merkle_proof_for_leaf(tree_id: str, leaf_index: int, db_path='merkle_tre
     try:
         # Get the stored root first
         cur.execute('''
-            SELECT root_hash 
+            SELECT root_hash, internal_nodes, leaves_blob
             FROM merkle_roots 
             WHERE tree_id = ?
         ''', (tree_id,))
@@ -139,35 +191,69 @@ def get_merkle_proof_for_leaf(tree_id: str, leaf_index: int, db_path='merkle_tre
             raise ValueError(f"No tree found with ID {tree_id}")
         
         root = root_row['root_hash']
+        internal_nodes = root_row['internal_nodes']
+        leaves = root_row['leaves_blob']
         
-        # Get all leaves for this tree
-        cur.execute('''
-            SELECT leaf_index, leaf_hash 
-            FROM merkle_leaves 
-            WHERE tree_id = ?
-        ''', (tree_id,))
+        if leaves is None:
+            # Get all leaves for this tree from the legacy one-row-per-leaf table
+            cur.execute('''
+                SELECT leaf_index, leaf_hash 
+                FROM merkle_leaves 
+                WHERE tree_id = ?
+            ''', (tree_id,))
+            
+            # Reconstruct leaves_db
+            leaves_db = {row['leaf_index']: row['leaf_hash'] for row in cur.fetchall()}
+            leaves = b''.join(leaves_db[i] for i in range(len(leaves_db)))
+        
+    finally:
+        cur.close()
+        conn.close()
+
+    if internal_nodes is not None:
+        size = len(internal_nodes) // 32
+        tree = _empty_tree(leaves, size, DEFAULT_HASH)
+        tree[size:] = np.frombuffer(internal_nodes, dtype=np.uint8).reshape(size, 32)
         
-        # Reconstruct leaves_db
-        leaves_db = {row['leaf_index']: row['leaf_hash'] for row in cur.fetchall()}
+        # Rehash the real leaves into layer 1 once, so leaves that no longer
+        # match the stored nodes fail here instead of yielding bad proofs
+        if size > 1:
+            n_pairs = (len(leaves) // 32 + 1) // 2
+            consistent = np.array_equal(_hash_layer(tree[:2 * n_pairs]), tree[size:size + n_pairs])
+            if not consistent:
+                raise ValueError("Stored leaves do not match stored internal nodes")
         
-        # Compute proof
-        default_hash = keccak256(b'\x00')
-        proof, computed_root = compute_merkle_proof(leaf_index, leaves_db, default_hash)
+        # root_hash is a separate column, so this catches corrupt or truncated internal_nodes
+        # (a single leaf is its own root, so for size 1 this checks the leaf)
+        if tree[2 * size - 2].tobytes() != root:
+            raise ValueError("Stored internal nodes do not match stored root")
+    else:
+        # Only legacy trees lack internal nodes, and those always come with leaves_db
+        tree, computed_root = build_tree(leaves_db)
+        size = len(tree) // 2
         
         # Verify that our computed root matches the stored root
         if computed_root != root:
             raise ValueError("Computed root does not match stored root")
-        
-        return root, proof
-        
-    finally:
-        cur.close()
-        conn.close()
+    
+    tree.flags.writeable = False  # Shared between callers through the cache
+    return root, tree, size
+
+def get_merkle_proof_for_leaf(tree_id: str, leaf_index: int, db_path='merkle_tree.db') -> Tuple[bytes, List[bytes]]:
+    """
+    Retrieve a leaf's proof from the local SQLite database.
+    The stored tree is loaded on the first request for `tree_id` and cached afterwards.
+    """
+    root, tree, size = _load_tree(tree_id, db_path)
+    if not 0 <= leaf_index < size:
+        raise ValueError(f"Leaf index {leaf_index} out of range for tree {tree_id}")
+    return root, extract_proof(tree, size, leaf_index)
 
 
 def store_merkle_leaves(df: pd.DataFrame, db_path='merkle_tree.db') -> str:
     """
-    Store the leaves, salts, predictions, and root in the local SQLite database.
+    Store the leaves, salts, predictions, root, and internal tree nodes in the local SQLite database.
+    Everything lives in a single merkle_roots row, with per-leaf data packed into contiguous blobs.
     """
     # Initialize the database if needed
     init_db(db_path)
@@ -178,35 +264,33 @@ def store_merkle_leaves(df: pd.DataFrame, db_path='merkle_tree.db') -> str:
     # Process predictions
     leaves_db, salts_db, predictions_db = create_merkle_leaves(df)
     
-    # Compute the root hash once
-    default_hash = keccak256(b'\x00')
-    _, root = compute_merkle_proof(0, leaves_db, default_hash)  # We can use any index since we want the full tree
+    # Build the tree once; its internal nodes are persisted so proofs never rehash
+    tree, root = build_tree(leaves_db)
+    size = len(tree) // 2
+    n_leaves = len(leaves_db)
+    
+    # Leaf i occupies bytes [32*i, 32*i+32) of leaves_blob and salts_blob, [8*i, 8*i+8) of predictions_blob.
+    # Predictions are big-endian like the leaf encoding, so predictions_blob[8*i:8*i+8] +
+    # salts_blob[32*i:32*i+32] is exactly the preimage hashed into leaf i.
+    leaves_blob = tree[:n_leaves].tobytes()
+    salts_blob = b''.join(salts_db[i] for i in range(n_leaves))
+    predictions_blob = df['pred'].to_numpy(dtype='>f8').tobytes()
     
     # Database connection
     conn = sqlite3.connect(db_path)
+    # WAL avoids rewriting the rollback journal; NORMAL skips an fsync per commit
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
     cur = conn.cursor()
     
     try:
-        # Store the root first
+        cur.execute('BEGIN')
+        
         cur.execute('''
             INSERT INTO merkle_roots 
-            (tree_id, root_hash)
-            VALUES (?, ?)
-        ''', (tree_id, root))
-        
-        # Store the leaves
-        for idx in leaves_db.keys():
-            cur.execute('''
-                INSERT INTO merkle_leaves 
-                (tree_id, leaf_index, leaf_hash, salt, prediction)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                tree_id,
-                idx,
-                leaves_db[idx],
-                salts_db[idx],
-                predictions_db[idx]
-            ))
+            (tree_id, root_hash, internal_nodes, leaves_blob, salts_blob, predictions_blob, n_leaves)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (tree_id, root, tree[size:].tobytes(), leaves_blob, salts_blob, predictions_blob, n_leaves))
         
         conn.commit()
         return tree_id
@@ -223,7 +307,7 @@ def init_db(db_path='merkle_tree.db'):
     conn = sqlite3.connect(db_path)
     cur = conn.cursor()
     
-    # Create the existing merkle_leaves table
+    # Legacy one-row-per-leaf table, still read for trees stored before leaves were packed into blobs
     cur.execute('''
     CREATE TABLE IF NOT EXISTS merkle_leaves (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -237,42 +321,79 @@ def init_db(db_path='merkle_tree.db'):
     )
     ''')
     
+    # Explicit index for per-tree scans and (tree_id, leaf_index) point lookups
+    cur.execute('''
+    CREATE INDEX IF NOT EXISTS idx_leaves_tree_idx ON merkle_leaves(tree_id, leaf_index)
+    ''')
+    
     # Create new table for storing tree roots
     cur.execute('''
     CREATE TABLE IF NOT EXISTS merkle_roots (
         tree_id TEXT PRIMARY KEY,
         root_hash BLOB NOT NULL,
+        internal_nodes BLOB,
+        leaves_blob BLOB,
+        salts_blob BLOB,
+        predictions_blob BLOB,
+        n_leaves INTEGER,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
     ''')
     
+    # Databases created by older versions lack the newer columns
+    columns = {row[1] for row in cur.execute('PRAGMA table_info(merkle_roots)')}
+    for column, column_type in (('internal_nodes', 'BLOB'), ('leaves_blob', 'BLOB'), ('salts_blob', 'BLOB'),
+                                ('predictions_blob', 'BLOB'), ('n_leaves', 'INTEGER')):
+        if column not in columns:
+            cur.execute(f'ALTER TABLE merkle_roots ADD COLUMN {column} {column_type}')
+    
     conn.commit()
     conn.close()
 
 
 
+CONTRACT_ADDRESS = '0x6baF889AEa470c01912ae209AcA04cB473929714'
+
+_W3 = None
+_CONTRACT = None
+
+def _get_w3() -> Web3:
+    """Returns the Web3 client shared by the on-chain helpers, creating it on first use."""
+    global _W3
+    if _W3 is None:
+        load_dotenv()
+        RPC_URL = os.getenv("BASE_SEPOLIA_RPC_URL", "https://sepolia.base.org")  # Base Sepolia RPC endpoint
+        # A shared session keeps the TCP/TLS connection to the RPC endpoint alive between calls
+        _W3 = Web3(Web3.HTTPProvider(RPC_URL, session=requests.Session()))
+    return _W3
+
+def _get_contract():
+    """Returns the PunkPredictor contract, parsing the ABI file only once."""
+    global _CONTRACT
+    if _CONTRACT is None:
+        with open('punk_predictor_abi.json') as f:
+            abi = json.load(f)
+        _CONTRACT = _get_w3().eth.contract(address=CONTRACT_ADDRESS, abi=abi)
+    return _CONTRACT
+
 def store_merkle_root(timestamp: int, root: bytes):
         
-    load_dotenv()
     # Configuration and inputs
-
-    RPC_URL = os.getenv("BASE_SEPOLIA_RPC_URL", "https://sepolia.base.org")  # Base Sepolia RPC endpoint
+    w3 = _get_w3()
     PRIVATE_KEY = os.getenv("PRIVATE_KEY")  # Private key for deploying and sending transactions
     CHAIN_ID = 84532     # Chain ID for Base Sepolia testnet
 
-
-    w3 = Web3(Web3.HTTPProvider(RPC_URL))
-
     account = w3.eth.account.from_key(PRIVATE_KEY)
-    contract_address = '0x6baF889AEa470c01912ae209AcA04cB473929714'
-
-    import json
-    abi = json.load(open('punk_predictor_abi.json'))
-    fee_kwargs = {'maxFeePerGas': 2000000378, 
-                'maxPriorityFeePerGas': 1000000000}
+    # Fetch the nonce and latest block in a single HTTP round trip
+    with w3.batch_requests() as batch:
+        batch.add(w3.eth.get_transaction_count(account.address))
+        batch.add(w3.eth.get_block("latest"))
+        nonce, latest_block = batch.execute()
+    base_fee = latest_block.get("baseFeePerGas") or 0
+    fee_kwargs = {'maxFeePerGas': base_fee + w3.to_wei(2, "gwei"),
+                'maxPriorityFeePerGas': w3.to_wei(1, "gwei")}
     # Store the Merkle root on-chain using the current timestamp as key
-    contract = w3.eth.contract(address=contract_address, abi=abi)
-    nonce = w3.eth.get_transaction_count(account.address)
+    contract = _get_contract()
     set_root_tx = contract.functions.setMerkleRoot(timestamp, root).build_transaction({
         "from": account.address,
         "nonce": nonce,
@@ -295,24 +416,53 @@ def store_merkle_root(timestamp: int, root: bytes):
 
 
 
-def verify_leaf(timestamp, PUNK_ID, proof_hex_list, tree_id):
+def verify_leaf(timestamp, PUNK_ID, proof, tree_id, onchain=False, db_path='merkle_tree.db'):
+    """
+    Check that leaf PUNK_ID of `tree_id` is included under the tree's stored root.
+    By default this is a local consistency check of the proof against the root in
+    SQLite only; it does not show that this root was published at `timestamp`.
+    Pass onchain=True to call the contract's verifyLeaf against the published root.
+    """
+    # sqlite3 binds numpy integers as BLOBs, which breaks both the substr() offset
+    # and the leaf_index comparison below, so normalise to a plain int first
+    PUNK_ID = operator.index(PUNK_ID)
+    
+    # Bring databases written by older versions up to the current schema before reading
+    init_db(db_path)
     
-    db_path = 'merkle_tree.db'
     conn = sqlite3.connect(db_path)
-    data = pd.read_sql_query('SELECT * FROM merkle_leaves WHERE tree_id = ?', conn, params=(tree_id,))
-    target_leaf = data.loc[PUNK_ID, 'leaf_hash']
+    try:
+        # substr() on a BLOB slices bytes (1-based), so only the target leaf leaves SQLite
+        root_row = conn.execute('''
+            SELECT root_hash, n_leaves, substr(leaves_blob, ?, 32)
+            FROM merkle_roots
+            WHERE tree_id = ?
+        ''', (32 * PUNK_ID + 1, tree_id)).fetchone()
+        if not root_row:
+            raise ValueError(f"No tree found with ID {tree_id}")
+        root, n_leaves, target_leaf = root_row
+        if n_leaves is None:
+            # Point lookup served by idx_leaves_tree_idx for legacy trees
+            leaf_row = conn.execute('''
+                SELECT leaf_hash
+                FROM merkle_leaves
+                WHERE tree_id = ? AND leaf_index = ?
+            ''', (tree_id, PUNK_ID)).fetchone()
+            target_leaf = leaf_row[0] if leaf_row else None
+        elif not 0 <= PUNK_ID < n_leaves:
+            target_leaf = None
+    finally:
+        conn.close()
+    if target_leaf is None:
+        raise ValueError(f"No leaf {PUNK_ID} found in tree {tree_id}")
     
-    RPC_URL = os.getenv("BASE_SEPOLIA_RPC_URL", "https://sepolia.base.org")  # Base Sepolia RPC endpoint
-    PRIVATE_KEY = os.getenv("PRIVATE_KEY")  # Private key for deploying and sending transactions
-
-
-    w3 = Web3(Web3.HTTPProvider(RPC_URL))
-
-
-    contract_address = '0x6baF889AEa470c01912ae209AcA04cB473929714'
-
-    abi = json.load(open('punk_predictor_abi.json'))
-    contract = w3.eth.contract(address=contract_address, abi=abi)
+    # Same sorted-pair keccak walk as the contract, but against the locally stored root;
+    # whether that root was actually published on-chain is only checked with onchain=True
+    if not onchain:
+        return verify_merkle_proof(target_leaf, PUNK_ID, proof, root)
+    
+    w3 = _get_w3()
+    contract = _get_contract()
     # Call verifyLeaf on the contract to verify the proof
     leaf_hex = "0x" + target_leaf.hex()
     proof_hex_list = ["0x" + p.hex() for p in proof]
@@ -323,40 +473,42 @@ def verify_leaf(timestamp, PUNK_ID, proof_hex_list, tree_id):
     print(f"Proof for Punk ID {PUNK_ID}: {[h for h in proof_hex_list]}")
     print(f"verifyLeaf returned: {verify_result}")
     print("Proof valid?", verify_merkle_proof(target_leaf, PUNK_ID, proof, root))
+    return verify_result
     
 def verify_merkle_proof(leaf: bytes, index: int, proof: List[bytes], root: bytes) -> bool:
+    # Step-by-step trace only when debug logging is on; formatting hex is not free
+    debug = logger.isEnabledFor(logging.DEBUG)
     h = leaf
-    print(f"Starting with leaf: {h.hex()}")
+    if debug:
+        logger.debug("Starting with leaf: %s", h.hex())
     for i, proof_element in enumerate(proof):
-        print(f"\nStep {i}:")
-        print(f"Current hash: {h.hex()}")
-        print(f"Proof element: {proof_element.hex()}")
-        if h <= proof_element:
-            print("h <= proof_element, concatenating h + proof_element")
-            h = keccak256(h + proof_element)
-        else:
-            print("h > proof_element, concatenating proof_element + h")
-            h = keccak256(proof_element + h)
-        print(f"New hash: {h.hex()}")
-    print(f"\nFinal hash: {h.hex()}")
-    print(f"Expected root: {root.hex()}")
+        # Sorted pair: the smaller hash always goes first
+        lo, hi = min(h, proof_element), max(h, proof_element)
+        if debug:
+            logger.debug("Step %d: current hash %s, proof element %s", i, h.hex(), proof_element.hex())
+        h = keccak256(lo + hi)
+        if debug:
+            logger.debug("Step %d: new hash %s", i, h.hex())
+    if debug:
+        logger.debug("Final hash: %s, expected root: %s", h.hex(), root.hex())
     return h == root
 
 
 
-# First create and store the tree
-# in reality this predictions are the ones from the ML rather than random
-predictions = pd.DataFrame({
-    'index': range(10000),
-    'pred': np.random.rand(10000)
-})
-tree_id = store_merkle_leaves(predictions)
+if __name__ == '__main__':
+    # First create and store the tree
+    # in reality this predictions are the ones from the ML rather than random
+    predictions = pd.DataFrame({
+        'index': range(10000),
+        'pred': np.random.rand(10000)
+    })
+    tree_id = store_merkle_leaves(predictions)
 
-PUNK_ID = 1234
-root, proof = get_merkle_proof_for_leaf(tree_id, PUNK_ID)
+    PUNK_ID = 1234
+    root, proof = get_merkle_proof_for_leaf(tree_id, PUNK_ID)
 
 
-timestamp = store_merkle_root(int(time.time()), root)
+    timestamp = store_merkle_root(int(time.time()), root)
 
 
-verify_leaf(timestamp, PUNK_ID, proof, tree_id)
\ No newline at end of file
+    verify_leaf(timestamp, PUNK_ID, proof, tree_id, onchain=True)